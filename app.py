@@ -1,9 +1,9 @@
-from flask import Flask, render_template, request, jsonify, Response, redirect, url_for
+from flask import Flask, render_template, request, Response, redirect, url_for
 from config import Config
 from utils.option_chain import OptionChainManager
 from utils.openalgo_client import ExtendedOpenAlgoAPI
 from utils.websocket_manager import ProfessionalWebSocketManager
-import json
+import orjson
 import time
 import threading
 import logging
@@ -25,40 +25,104 @@ app.config.from_object(Config)
 logger.info(f"Config loaded: HOST={app.config.get('OPENALGO_HOST')}, WS={app.config.get('OPENALGO_WS_URL')}")
 logger.info(f"API Key present: {bool(app.config.get('OPENALGO_API_KEY'))}")
 
+# Seconds between keep-alive comments on an idle SSE stream
+SSE_HEARTBEAT_INTERVAL = 15
+
+# Seconds to let a burst of ticks accumulate before encoding the next SSE frame
+SSE_COALESCE_WINDOW = 0.05
+
+# Seconds between full snapshots; frames in between only carry changed strikes
+SSE_KEYFRAME_INTERVAL = 30
+
+# Seconds to wait for a new WebSocket connection to authenticate
+WS_READY_TIMEOUT = 5
+
 # Global instances
 active_managers = {}
-websocket_managers = {}
 shared_websocket_manager = None
+api_client = None
+api_client_lock = threading.Lock()
+
+# Taken only when an instance has to be created; lookups stay lock-free
+managers_lock = threading.Lock()
+websocket_lock = threading.Lock()
+
+# One creation lock per underlying/expiry, so building one chain never
+# blocks requests for another; managers_lock only guards this dict
+manager_locks = {}
+
+def json_response(obj, status=200):
+    """Serialize obj with orjson into a JSON response"""
+    return app.response_class(orjson.dumps(obj), status=status, mimetype='application/json')
 
 def get_api_client():
-    """Create OpenAlgo API client from config"""
-    return ExtendedOpenAlgoAPI(
-        api_key=app.config['OPENALGO_API_KEY'],
-        host=app.config['OPENALGO_HOST']
-    )
-
-def get_or_create_websocket_manager(underlying):
-    """Get or create a WebSocket manager for the underlying"""
+    """Return the shared OpenAlgo API client, creating it from config on first use"""
+    global api_client
+    if api_client is None:
+        with api_client_lock:
+            if api_client is None:
+                api_client = ExtendedOpenAlgoAPI(
+                    api_key=app.config['OPENALGO_API_KEY'],
+                    host=app.config['OPENALGO_HOST']
+                )
+    return api_client
+
+def get_or_create_websocket_manager():
+    """Get or create the WebSocket connection shared by every option chain"""
     global shared_websocket_manager
     
-    # Use shared manager if available and active
-    if shared_websocket_manager and shared_websocket_manager.active:
-        return shared_websocket_manager
-        
-    # Create new manager
-    ws_manager = ProfessionalWebSocketManager()
-    ws_manager.connect(
-        ws_url=app.config['OPENALGO_WS_URL'],
-        api_key=app.config['OPENALGO_API_KEY']
-    )
-    
-    # Wait for connection
-    time.sleep(1)
+    # Once connected, the shared manager reconnects and resubscribes by itself
+    ws_manager = shared_websocket_manager
+    if ws_manager is not None and ws_manager.running:
+        return ws_manager
     
-    if ws_manager.active:
+    with websocket_lock:
+        # Another request may have connected while we waited for the lock
+        ws_manager = shared_websocket_manager
+        if ws_manager is not None and ws_manager.running:
+            return ws_manager
+        
+        # Create new manager
+        ws_manager = ProfessionalWebSocketManager()
+        if not ws_manager.connect(
+            ws_url=app.config['OPENALGO_WS_URL'],
+            api_key=app.config['OPENALGO_API_KEY']
+        ):
+            return None
+        
+        # A slow server only delays data: the manager keeps retrying and
+        # sends the queued subscriptions once it authenticates
+        if not ws_manager.wait_until_ready(timeout=WS_READY_TIMEOUT):
+            logger.warning(f"WebSocket not authenticated after {WS_READY_TIMEOUT}s, subscriptions will be sent once it is")
         shared_websocket_manager = ws_manager
         return ws_manager
-    return None
+
+def get_or_create_manager(underlying, expiry):
+    """Return the streaming option chain manager for underlying/expiry, creating it once"""
+    manager_key = f"{underlying}_{expiry}"
+    
+    manager = active_managers.get(manager_key)
+    if manager is not None:
+        return manager
+    
+    with managers_lock:
+        key_lock = manager_locks.setdefault(manager_key, threading.Lock())
+    
+    with key_lock:
+        manager = active_managers.get(manager_key)
+        if manager is None:
+            client = get_api_client()
+            ws_manager = get_or_create_websocket_manager()
+            
+            manager = OptionChainManager(underlying, expiry, websocket_manager=ws_manager)
+            manager.initialize(client)
+            
+            # Without a WebSocket the chain never gets data; build it
+            # again on the next request instead of caching a static one
+            if ws_manager is not None:
+                manager.start_monitoring()
+                active_managers[manager_key] = manager
+    return manager
 
 @app.route('/')
 def index():
@@ -89,9 +153,9 @@ def option_chain():
         # Initialize option chain manager
         manager_key = f"{underlying}_{expiry}"
         
-        if manager_key in active_managers:
+        manager = active_managers.get(manager_key)
+        if manager is not None:
             logger.debug(f"Reusing active manager for {manager_key}")
-            manager = active_managers[manager_key]
         else:
             logger.info(f"Creating new manager for {manager_key}")
             manager = OptionChainManager(underlying, expiry)
@@ -130,38 +194,40 @@ def get_expiry_dates(underlying):
         )
         logger.debug(f"Expiry response for {underlying}: {expiry_response}")
         
-        return jsonify(expiry_response)
+        return json_response(expiry_response)
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+        return json_response({'status': 'error', 'message': str(e)}, status=500)
 
 @app.route('/trading/api/option-chain/stream/<underlying>')
 def option_chain_stream(underlying):
     expiry = request.args.get('expiry')
     
     def generate():
-        manager_key = f"{underlying}_{expiry}"
-        
-        # Get or create manager
-        if manager_key in active_managers:
-            manager = active_managers[manager_key]
-        else:
-            client = get_api_client()
-            ws_manager = get_or_create_websocket_manager(underlying)
+        try:
+            manager = get_or_create_manager(underlying, expiry)
+            sent_version = None
+            next_keyframe = 0
             
-            manager = OptionChainManager(underlying, expiry, websocket_manager=ws_manager)
-            manager.initialize(client)
-            manager.start_monitoring()
-            active_managers[manager_key] = manager
-        
-        while True:
-            try:
-                chain_data = manager.get_option_chain()
-                yield f"data: {json.dumps(chain_data)}\n\n"
-                time.sleep(1)
-            except Exception as e:
-                logger.error(f"Stream error: {e}")
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
-                break
+            while True:
+                version = manager.version
+                now = time.monotonic()
+                if sent_version is None or now >= next_keyframe:
+                    frame = manager.get_option_chain_bytes()
+                    next_keyframe = now + SSE_KEYFRAME_INTERVAL
+                else:
+                    frame = manager.get_option_chain_patch_bytes(sent_version)
+                sent_version = version
+                yield b"data: " + frame + b"\n\n"
+                
+                # Push on change; comment lines keep idle connections alive through proxies
+                while not manager.wait_for_update(version, timeout=SSE_HEARTBEAT_INTERVAL):
+                    yield b": heartbeat\n\n"
+                
+                # Fold the rest of the burst into the same frame
+                time.sleep(SSE_COALESCE_WINDOW)
+        except Exception as e:
+            logger.error(f"Stream error: {e}")
+            yield b"data: " + orjson.dumps({'error': str(e)}) + b"\n\n"
                 
     return Response(generate(), mimetype='text/event-stream')
 
@@ -173,25 +239,17 @@ def create_session():
     expiry = data.get('expiry')
     
     # Ensure manager exists
-    manager_key = f"{underlying}_{expiry}"
-    if manager_key not in active_managers:
-        client = get_api_client()
-        ws_manager = get_or_create_websocket_manager(underlying)
-        
-        manager = OptionChainManager(underlying, expiry, websocket_manager=ws_manager)
-        manager.initialize(client)
-        manager.start_monitoring()
-        active_managers[manager_key] = manager
+    get_or_create_manager(underlying, expiry)
     
-    return jsonify({'status': 'success', 'session_id': 'mock-session', 'subscribed_symbols': 0})
+    return json_response({'status': 'success', 'session_id': 'mock-session', 'subscribed_symbols': 0})
 
 @app.route('/trading/api/option-chain-session/heartbeat', methods=['POST'])
 def session_heartbeat():
-    return jsonify({'status': 'success'})
+    return json_response({'status': 'success'})
 
 @app.route('/trading/api/option-chain-session/destroy', methods=['POST'])
 def destroy_session():
-    return jsonify({'status': 'success'})
+    return json_response({'status': 'success'})
 
 if __name__ == '__main__':
     app.run(debug=False, port=5800)
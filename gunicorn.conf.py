@@ -0,0 +1,15 @@
+"""
+Gunicorn configuration for serving the option chain in production
+Usage: gunicorn app:app
+"""
+
+bind = '0.0.0.0:5800'
+
+# Option chain managers and the shared WebSocket live in process memory,
+# so everything must run inside a single worker
+workers = 1
+
+# SSE streams spend their life blocked waiting for updates; gevent
+# multiplexes them (and the WebSocket reader) onto one cooperative worker
+worker_class = 'gevent'
+worker_connections = 1000
@@ -1,11 +1,54 @@
 """
 Extended OpenAlgo API client with additional methods
 """
+import httpx
 from openalgo import api
 
 class ExtendedOpenAlgoAPI(api):
-    """Extended OpenAlgo API client with ping method"""
-    
+    """Extended OpenAlgo API client with ping method and pooled connections"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Keep-alive pool reused across requests instead of a new connection per call
+        self.http_client = httpx.Client(
+            headers=self.headers,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=10)
+        )
+
+    def _make_request(self, endpoint, payload):
+        """
+        Make HTTP request over the pooled client with the same error handling as the SDK
+        """
+        url = self.base_url + endpoint
+        try:
+            response = self.http_client.post(url, json=payload)
+            return self._handle_response(response)
+        except httpx.TimeoutException:
+            return {
+                'status': 'error',
+                'message': 'Request timed out. The server took too long to respond.',
+                'error_type': 'timeout_error'
+            }
+        except httpx.ConnectError:
+            return {
+                'status': 'error',
+                'message': 'Failed to connect to the server. Please check if the server is running.',
+                'error_type': 'connection_error'
+            }
+        except httpx.HTTPError as e:
+            return {
+                'status': 'error',
+                'message': f'HTTP error occurred: {str(e)}',
+                'error_type': 'http_error'
+            }
+        except Exception as e:
+            return {
+                'status': 'error',
+                'message': f'An unexpected error occurred: {str(e)}',
+                'error_type': 'unknown_error'
+            }
+
     def ping(self):
         """
         Test connectivity and validate API key authentication
@@ -3,35 +3,101 @@ Option Chain Manager Module
 Real-time option chain management for NIFTY and BANKNIFTY with market depth
 """
 
-import json
 import threading
 import time
 from datetime import datetime, timedelta
 from collections import deque
 from typing import Dict, List, Optional, Any
 import logging
-from cachetools import TTLCache
 import pytz
+import orjson
+import numpy as np
+from numba import njit
 
 # from openalgo import api # Removed dependency
 
 logger = logging.getLogger(__name__)
 
+# Depth fields kept per strike; each field is one contiguous row of the CE/PE arrays
+# Prices (ltp/bid/ask) are stored as integer paise, quantities as plain integers
+DEPTH_FIELDS = ('ltp', 'bid', 'ask', 'bid_qty', 'ask_qty', 'volume', 'oi')
+LTP, BID, ASK, BID_QTY, ASK_QTY, VOLUME, OI = range(len(DEPTH_FIELDS))
+PAISE = 100
 
-class OptionChainCache:
-    """Zero-config cache for option chain data"""
-    
-    def __init__(self, maxsize=100, ttl=30):
-        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
-        self.lock = threading.Lock()
+# Strikes generated on each side of ATM
+STRIKES_PER_SIDE = 20
+
+# Tag for each position relative to ATM, indexed by position + STRIKES_PER_SIDE
+TAG_TABLE = tuple(
+    [f'ITM{i}' for i in range(STRIKES_PER_SIDE, 0, -1)] + ['ATM'] +
+    [f'OTM{i}' for i in range(1, STRIKES_PER_SIDE + 1)]
+)
+
+IST = pytz.timezone('Asia/Kolkata')
+
+
+def _position_tag(position):
+    """Return the ITM/ATM/OTM tag for a strike position relative to ATM"""
+    if -STRIKES_PER_SIDE <= position <= STRIKES_PER_SIDE:
+        return TAG_TABLE[position + STRIKES_PER_SIDE]
+    # ATM has drifted beyond the generated strikes
+    return f'OTM{position}' if position > 0 else f'ITM{-position}'
+
+
+@njit('UniTuple(int64, 4)(int64[:, ::1], int64[:, ::1])', cache=True, nogil=True)
+def _depth_totals(ce_arr, pe_arr):
+    """Sum CE/PE volume and OI in a single compiled pass"""
+    ce_volume = 0
+    pe_volume = 0
+    ce_oi = 0
+    pe_oi = 0
+    for i in range(ce_arr.shape[1]):
+        ce_volume += ce_arr[VOLUME, i]
+        pe_volume += pe_arr[VOLUME, i]
+        ce_oi += ce_arr[OI, i]
+        pe_oi += pe_arr[OI, i]
+    return ce_volume, pe_volume, ce_oi, pe_oi
+
+
+def _level_any_shape(level):
+    """Return (price, quantity) from a depth level whose shape is not known yet"""
+    if isinstance(level, dict):
+        return level.get('price', 0), level.get('quantity', 0)
+    if isinstance(level, (list, tuple)) and len(level) >= 2:
+        return level[0], level[1]
+    return 0, 0
+
+
+def _normalize_depth(data, extract_level=_level_any_shape):
+    """Reduce a depth payload to a tuple ordered like DEPTH_FIELDS"""
+    depth = data.get('depth')
+    if depth:
+        bids = depth.get('buy', depth.get('bids', []))
+        asks = depth.get('sell', depth.get('asks', []))
+    else:
+        bids = data.get('bids', [])
+        asks = data.get('asks', [])
     
-    def get(self, key):
-        with self.lock:
-            return self.cache.get(key)
+    bid, bid_qty = extract_level(bids[0]) if bids else (0, 0)
+    ask, ask_qty = extract_level(asks[0]) if asks else (0, 0)
+    ltp = data.get('ltp') or data.get('last_price') or 0
     
-    def set(self, key, value):
-        with self.lock:
-            self.cache[key] = value
+    return (
+        round(float(ltp) * PAISE), round(float(bid or 0) * PAISE), round(float(ask or 0) * PAISE),
+        int(bid_qty or 0), int(ask_qty or 0),
+        int(data.get('volume', 0) or 0), int(data.get('oi', 0) or 0)
+    )
+
+
+def _depth_dict(row):
+    """Expand one strike's depth row into the per-side dict, with prices in rupees"""
+    ltp, bid, ask, bid_qty, ask_qty, volume, oi = row
+    return {
+        'ltp': ltp / PAISE, 'bid': bid / PAISE, 'ask': ask / PAISE,
+        'bid_qty': bid_qty, 'ask_qty': ask_qty,
+        'spread': (ask - bid) / PAISE if bid > 0 and ask > 0 else 0,
+        'volume': volume, 'oi': oi
+    }
 
 
 class OptionChainManager:
@@ -44,17 +110,35 @@ class OptionChainManager:
         self.underlying = underlying
         self.expiry = expiry
         self.strike_step = 50 if underlying == 'NIFTY' else 100
-        self.option_data = {}
+        self._expiry_prefix = self._parse_expiry(expiry)
+        self.strikes = []
+        self.atm_idx = 0
         self.subscription_map = {}
+        self._ce_symbols = []
+        self._pe_symbols = []
+        self.ce_arr = np.zeros((len(DEPTH_FIELDS), 0), dtype=np.int64)
+        self.pe_arr = np.zeros((len(DEPTH_FIELDS), 0), dtype=np.int64)
         self.underlying_ltp = 0
         self.underlying_bid = 0
         self.underlying_ask = 0
         self.atm_strike = 0
         self.websocket_manager = websocket_manager
-        self.cache = OptionChainCache()
         self.monitoring_active = False
         self.initialized = False
         self.manager_id = f"{underlying}_{expiry}"
+        
+        # Bumped on every mutation; serialized frames are reused until it moves
+        self._version = 0
+        self._cached_frame = None
+        
+        # Version at which each strike last changed, and at which strikes were laid out
+        self._row_versions = np.zeros(0, dtype=np.int64)
+        self._layout_version = -1
+        self._update_cond = threading.Condition()
+        
+        # Metrics only depend on depth data, so quote ticks reuse the last result
+        self._metrics_dirty = True
+        self._last_metrics = None
     
     def initialize(self, api_client):
         """Setup option chain with depth subscriptions"""
@@ -75,7 +159,7 @@ class OptionChainManager:
             # If we already have underlying_ltp from WebSocket, use it
             if self.underlying_ltp and self.underlying_ltp > 0:
                 # Calculate ATM strike from existing LTP
-                self.atm_strike = round(self.underlying_ltp / self.strike_step) * self.strike_step
+                self.atm_strike = self._nearest_strike(self.underlying_ltp)
                 logger.debug(f"{self.underlying} LTP: {self.underlying_ltp}, ATM: {self.atm_strike} (from cached)")
                 return self.atm_strike
             
@@ -91,7 +175,7 @@ class OptionChainManager:
                 
                 # Calculate ATM strike
                 if self.underlying_ltp > 0:
-                    self.atm_strike = round(self.underlying_ltp / self.strike_step) * self.strike_step
+                    self.atm_strike = self._nearest_strike(self.underlying_ltp)
                     logger.debug(f"{self.underlying} LTP: {self.underlying_ltp}, ATM: {self.atm_strike} (from API)")
                     return self.atm_strike
                 else:
@@ -104,6 +188,11 @@ class OptionChainManager:
             logger.error(f"Error calculating ATM: {e}")
             return 0
     
+    def _nearest_strike(self, ltp):
+        """Round a price to the nearest strike using integer paise arithmetic"""
+        step_paise = self.strike_step * 100
+        return (round(ltp * 100) + step_paise // 2) // step_paise * self.strike_step
+    
     def generate_strikes(self):
         """Create strike list with proper tagging"""
         logger.debug(f"generate_strikes called for {self.underlying}, ATM: {self.atm_strike}")
@@ -111,81 +200,47 @@ class OptionChainManager:
             logger.warning("generate_strikes skipped: ATM is 0")
             return
         
-        strikes = []
+        # 20 strikes either side of ATM (ITM below for CE, OTM above)
+        step = self.strike_step
+        strikes = [self.atm_strike + position * step
+                   for position in range(-STRIKES_PER_SIDE, STRIKES_PER_SIDE + 1)]
+        self.strikes = strikes
+        self.atm_idx = STRIKES_PER_SIDE
         
-        # Generate ITM strikes (20 strikes below ATM for CE, above for PE)
-        for i in range(20, 0, -1):
-            strike = self.atm_strike - (i * self.strike_step)
-            strikes.append({
-                'strike': strike,
-                'tag': f'ITM{i}',
-                'position': -i
-            })
-        
-        # Add ATM strike
-        strikes.append({
-            'strike': self.atm_strike,
-            'tag': 'ATM',
-            'position': 0
-        })
+        # Depth values live in per-side arrays indexed by strike position
+        self.ce_arr = np.zeros((len(DEPTH_FIELDS), len(strikes)), dtype=np.int64)
+        self.pe_arr = np.zeros((len(DEPTH_FIELDS), len(strikes)), dtype=np.int64)
+        self._metrics_dirty = True
+        self._row_versions = np.zeros(len(strikes), dtype=np.int64)
+        self._layout_version = self._version
         
-        # Generate OTM strikes (20 strikes above ATM for CE, below for PE)
-        for i in range(1, 21):
-            strike = self.atm_strike + (i * self.strike_step)
-            strikes.append({
-                'strike': strike,
-                'tag': f'OTM{i}',
-                'position': i
-            })
+        # Symbols aligned with the depth arrays
+        self._ce_symbols = [self.construct_option_symbol(strike, 'CE') for strike in strikes]
+        self._pe_symbols = [self.construct_option_symbol(strike, 'PE') for strike in strikes]
         
-        # Initialize option data structure
-        for strike_info in strikes:
-            strike = strike_info['strike']
-            self.option_data[strike] = {
-                'strike': strike,
-                'tag': strike_info['tag'],
-                'position': strike_info['position'],
-                'ce_symbol': self.construct_option_symbol(strike, 'CE'),
-                'pe_symbol': self.construct_option_symbol(strike, 'PE'),
-                'ce_data': {
-                    'ltp': 0, 'bid': 0, 'ask': 0, 'bid_qty': 0,
-                    'ask_qty': 0, 'spread': 0, 'volume': 0, 'oi': 0
-                },
-                'pe_data': {
-                    'ltp': 0, 'bid': 0, 'ask': 0, 'bid_qty': 0,
-                    'ask_qty': 0, 'spread': 0, 'volume': 0, 'oi': 0
-                }
-            }
-            
-            # Map symbols to strikes for quick lookup
-            self.subscription_map[self.option_data[strike]['ce_symbol']] = {
-                'strike': strike, 'type': 'CE'
-            }
-            self.subscription_map[self.option_data[strike]['pe_symbol']] = {
-                'strike': strike, 'type': 'PE'
-            }
+        # Map symbols to (array index, is_ce) for quick lookup
+        for idx in range(len(strikes)):
+            self.subscription_map[self._ce_symbols[idx]] = (idx, True)
+            self.subscription_map[self._pe_symbols[idx]] = (idx, False)
         
         logger.info(f"Generated {len(strikes)} strikes for {self.underlying}. ATM: {self.atm_strike}")
     
-    def construct_option_symbol(self, strike, option_type):
-        """Construct OpenAlgo option symbol"""
-        # Format: [Base Symbol][Expiration Date][Strike Price][Option Type]
+    def _parse_expiry(self, expiry):
+        """Format expiry as the DDMMMYY part of OpenAlgo option symbols"""
         # Date format: DDMMMYY (e.g., 28AUG25 for August 28, 2025)
-        
-        # Parse expiry date to proper format
         expiry_formatted = None
         
-        if isinstance(self.expiry, str):
+        if isinstance(expiry, str):
             try:
                 # Handle format like "28-AUG-25" -> "28AUG"
-                parts = self.expiry.split('-')
+                parts = expiry.split('-')
                 if len(parts) >= 2:
                     day = parts[0].zfill(2)
                     month = parts[1].upper()[:3]
                     expiry_formatted = f"{day}{month}"
                 else:
                     # Extract day and month
-                    expiry_clean = self.expiry.replace('-', '').upper()
+                    expiry_clean = expiry.replace('-', '').upper()
                     for mon in ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']:
                         if mon in expiry_clean:
                             idx = expiry_clean.index(mon)
@@ -199,22 +254,18 @@ class OptionChainManager:
             except Exception as e:
                 logger.error(f"Error parsing expiry: {e}")
                 expiry_formatted = '28AUG'
-        elif isinstance(self.expiry, datetime):
-            expiry_formatted = self.expiry.strftime('%d%b').upper()
+        elif isinstance(expiry, datetime):
+            expiry_formatted = expiry.strftime('%d%b').upper()
         else:
             expiry_formatted = '28AUG'
         
-        # Remove decimal if whole number
-        if strike == int(strike):
-            strike_str = str(int(strike))
-        else:
-            strike_str = str(strike)
-        
-        # Construct symbol: BASE + EXPIRY + 25 + STRIKE + CE/PE
         # The "25" is the year 2025, hardcoded for now
-        symbol = f"{self.underlying}{expiry_formatted}25{strike_str}{option_type}"
-        
-        return symbol
+        return f"{expiry_formatted}25"
+    
+    def construct_option_symbol(self, strike, option_type):
+        """Construct OpenAlgo option symbol"""
+        # Format: [Base Symbol][Expiration Date][Strike Price][Option Type]
+        return f"{self.underlying}{self._expiry_prefix}{int(strike)}{option_type}"
     
     def setup_depth_subscriptions(self):
         """Configure WebSocket subscriptions"""
@@ -222,10 +273,6 @@ class OptionChainManager:
             logger.warning("WebSocket manager not available for subscriptions")
             return
         
-        # Register handlers
-        self.websocket_manager.register_handler('depth', self.handle_depth_update)
-        self.websocket_manager.register_handler('quote', self.handle_quote_update)
-        
         # Subscribe to underlying
         self.subscribe_underlying_quote()
         
@@ -241,6 +288,7 @@ class OptionChainManager:
                 'symbol': self.underlying,
                 'mode': 'quote'
             }
+            self.websocket_manager.register_symbol_handler('quote', self.underlying, self.handle_quote_update)
             self.websocket_manager.subscribe(subscription)
     
     def batch_subscribe_options(self):
@@ -250,16 +298,18 @@ class OptionChainManager:
         
         exchange = 'BFO' if self.underlying == 'SENSEX' else 'NFO'
         instruments = []
-        for strike_data in self.option_data.values():
-            instruments.append({'symbol': strike_data['ce_symbol'], 'exchange': exchange})
-            instruments.append({'symbol': strike_data['pe_symbol'], 'exchange': exchange})
+        for ce_symbol, pe_symbol in zip(self._ce_symbols, self._pe_symbols):
+            instruments.append({'symbol': ce_symbol, 'exchange': exchange})
+            instruments.append({'symbol': pe_symbol, 'exchange': exchange})
+        
+        # Only ticks for this chain's own symbols are routed to it
+        for inst in instruments:
+            self.websocket_manager.register_symbol_handler('depth', inst['symbol'], self.handle_depth_update)
         
         self.websocket_manager.subscribe_batch(instruments, mode='depth')
     
-    def handle_quote_update(self, data):
+    def handle_quote_update(self, symbol, data):
         """Handle quote updates for underlying index"""
-        symbol = data.get('symbol', '')
-        
         if symbol == self.underlying:
             ltp = data.get('ltp', 0)
             if ltp:
@@ -271,7 +321,7 @@ class OptionChainManager:
                 
                 if old_atm != self.atm_strike:
                     # If strikes haven't been generated yet, generate them now
-                    if not self.option_data:
+                    if not self.strikes:
                         self.generate_strikes()
                         if self.websocket_manager and self.websocket_manager.authenticated:
                             self.batch_subscribe_options()
@@ -280,71 +330,42 @@ class OptionChainManager:
                 
                 self.underlying_bid = float(data.get('bid', 0) or 0)
                 self.underlying_ask = float(data.get('ask', 0) or 0)
+                self._mark_updated()
     
-    def handle_depth_update(self, data):
+    def handle_depth_update(self, symbol, data):
         """Process incoming depth data for options"""
-        symbol = data.get('symbol') or data.get('Symbol') or data.get('trading_symbol') or ''
+        entry = self.subscription_map.get(symbol)
+        if entry is None:
+            return
         
-        if symbol in self.subscription_map:
-            strike_info = self.subscription_map[symbol]
-            option_type = strike_info['type']
-            strike = strike_info['strike']
-            
-            # Extract data
-            depth_data_raw = data.get('depth', {})
-            if depth_data_raw:
-                bids = depth_data_raw.get('buy', depth_data_raw.get('bids', []))
-                asks = depth_data_raw.get('sell', depth_data_raw.get('asks', []))
-            else:
-                bids = data.get('bids', [])
-                asks = data.get('asks', [])
-            
-            ltp = data.get('ltp') or data.get('last_price') or 0
-            
-            best_bid = 0
-            best_ask = 0
-            bid_qty = 0
-            ask_qty = 0
-            
-            if bids and len(bids) > 0:
-                if isinstance(bids[0], dict):
-                    best_bid = bids[0].get('price', 0)
-                    bid_qty = bids[0].get('quantity', 0)
-                elif isinstance(bids[0], (list, tuple)) and len(bids[0]) >= 2:
-                    best_bid = bids[0][0]
-                    bid_qty = bids[0][1]
-            
-            if asks and len(asks) > 0:
-                if isinstance(asks[0], dict):
-                    best_ask = asks[0].get('price', 0)
-                    ask_qty = asks[0].get('quantity', 0)
-                elif isinstance(asks[0], (list, tuple)) and len(asks[0]) >= 2:
-                    best_ask = asks[0][0]
-                    ask_qty = asks[0][1]
-            
-            depth_data = {
-                'ltp': float(ltp) if ltp else 0,
-                'bid': float(best_bid) if best_bid else 0,
-                'ask': float(best_ask) if best_ask else 0,
-                'bid_qty': int(bid_qty) if bid_qty else 0,
-                'ask_qty': int(ask_qty) if ask_qty else 0,
-                'spread': 0,
-                'volume': int(data.get('volume', 0) or 0),
-                'oi': int(data.get('oi', 0) or 0)
-            }
-            
-            if depth_data['bid'] > 0 and depth_data['ask'] > 0:
-                depth_data['spread'] = depth_data['ask'] - depth_data['bid']
-            
-            self.update_option_depth(strike, option_type, depth_data)
+        # The level shape is fixed per connection; the WebSocket manager detects it once
+        extract_level = _level_any_shape
+        if self.websocket_manager and self.websocket_manager.depth_level_extractor:
+            extract_level = self.websocket_manager.depth_level_extractor
+        
+        idx, is_ce = entry
+        arr = self.ce_arr if is_ce else self.pe_arr
+        arr[:, idx] = _normalize_depth(data, extract_level)
+        self._metrics_dirty = True
+        self._mark_updated(idx)
     
-    def update_option_depth(self, strike, option_type, depth_data):
-        """Update option chain with depth data"""
-        if strike in self.option_data:
-            if option_type == 'CE':
-                self.option_data[strike]['ce_data'] = depth_data
-            else:
-                self.option_data[strike]['pe_data'] = depth_data
+    @property
+    def version(self):
+        """Counter that moves whenever the chain data changes"""
+        return self._version
+    
+    def _mark_updated(self, idx=None):
+        """Bump the version, stamp the changed strike, and wake any stream waiting for new data"""
+        with self._update_cond:
+            self._version += 1
+            if idx is not None:
+                self._row_versions[idx] = self._version
+            self._update_cond.notify_all()
+    
+    def wait_for_update(self, version, timeout=None):
+        """Block until the chain moves past version; returns False on timeout"""
+        with self._update_cond:
+            return self._update_cond.wait_for(lambda: self._version != version, timeout)
     
     def get_option_chain(self):
         """Return formatted option chain data"""
@@ -355,31 +376,108 @@ class OptionChainManager:
             'underlying_ask': self.underlying_ask,
             'atm_strike': self.atm_strike,
             'expiry': self.expiry,
-            'timestamp': datetime.now(pytz.timezone('Asia/Kolkata')).isoformat(),
-            'options': list(self.option_data.values()),
+            'timestamp': datetime.now(IST),
+            'options': self._build_options(),
             'market_metrics': self.calculate_market_metrics()
         }
         logger.debug(f"get_option_chain returning: {len(data['options'])} options, ATM: {data['atm_strike']}")
         return data
     
+    def _build_options(self):
+        """Merge per-strike info with the CE/PE depth arrays"""
+        ce_rows = self.ce_arr.T.tolist()
+        pe_rows = self.pe_arr.T.tolist()
+        options = []
+        for idx, (strike, ce_symbol, pe_symbol, ce, pe) in enumerate(
+                zip(self.strikes, self._ce_symbols, self._pe_symbols, ce_rows, pe_rows)):
+            position = idx - self.atm_idx
+            options.append({
+                'strike': strike,
+                'tag': _position_tag(position),
+                'position': position,
+                'ce_symbol': ce_symbol,
+                'pe_symbol': pe_symbol,
+                'ce_data': _depth_dict(ce),
+                'pe_data': _depth_dict(pe)
+            })
+        return options
+    
+    def get_option_chain_columns(self):
+        """
+        Return the option chain with depth as parallel per-field arrays
+        Index i of every array in 'ce'/'pe' belongs to strikes[i]; prices are in paise
+        """
+        return {
+            'underlying': self.underlying,
+            'underlying_ltp': self.underlying_ltp,
+            'underlying_bid': self.underlying_bid,
+            'underlying_ask': self.underlying_ask,
+            'atm_strike': self.atm_strike,
+            'expiry': self.expiry,
+            'timestamp': datetime.now(IST),
+            'strikes': self.strikes,
+            'atm_idx': self.atm_idx,
+            'ce': {field: self.ce_arr[i] for i, field in enumerate(DEPTH_FIELDS)},
+            'pe': {field: self.pe_arr[i] for i, field in enumerate(DEPTH_FIELDS)},
+            'market_metrics': self.calculate_market_metrics()
+        }
+    
+    def get_option_chain_patch(self, since_version):
+        """
+        Return only the strikes that changed after since_version
+        'idx' holds their positions in strikes; 'ce'/'pe' arrays are aligned with it
+        """
+        idx = np.flatnonzero(self._row_versions > since_version)
+        return {
+            'patch': True,
+            'underlying_ltp': self.underlying_ltp,
+            'underlying_bid': self.underlying_bid,
+            'underlying_ask': self.underlying_ask,
+            'atm_strike': self.atm_strike,
+            'timestamp': datetime.now(IST),
+            'atm_idx': self.atm_idx,
+            'idx': idx,
+            'ce': {field: self.ce_arr[i, idx] for i, field in enumerate(DEPTH_FIELDS)},
+            'pe': {field: self.pe_arr[i, idx] for i, field in enumerate(DEPTH_FIELDS)},
+            'market_metrics': self.calculate_market_metrics()
+        }
+    
+    def get_option_chain_bytes(self):
+        """Return the columnar option chain as JSON bytes, reused until the data changes"""
+        key = (self._version, self.underlying_ltp)
+        cached = self._cached_frame
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        
+        # Array rows are contiguous, so orjson writes them without Python boxing
+        frame = orjson.dumps(self.get_option_chain_columns(), option=orjson.OPT_SERIALIZE_NUMPY)
+        self._cached_frame = (key, frame)
+        return frame
+    
+    def get_option_chain_patch_bytes(self, since_version):
+        """Return the changes after since_version as JSON bytes, or a full frame if strikes were re-laid out"""
+        if since_version <= self._layout_version:
+            return self.get_option_chain_bytes()
+        return orjson.dumps(self.get_option_chain_patch(since_version), option=orjson.OPT_SERIALIZE_NUMPY)
+    
     def update_option_tags(self):
         """Update option tags when ATM changes"""
-        for strike_data in self.option_data.values():
-            strike = strike_data['strike']
-            position = self.get_strike_position(strike)
-            strike_data['position'] = position
-            strike_data['tag'] = self.get_position_tag(position)
+        # Tags are derived from each strike's offset to atm_idx when serialized
+        if self.strikes:
+            self.atm_idx = (self.atm_strike - self.strikes[0]) // self.strike_step
     
     def calculate_market_metrics(self):
         """Calculate PCR and other metrics"""
-        total_ce_volume = sum(opt['ce_data'].get('volume', 0) for opt in self.option_data.values())
-        total_pe_volume = sum(opt['pe_data'].get('volume', 0) for opt in self.option_data.values())
-        total_ce_oi = sum(opt['ce_data'].get('oi', 0) for opt in self.option_data.values())
-        total_pe_oi = sum(opt['pe_data'].get('oi', 0) for opt in self.option_data.values())
+        if not self._metrics_dirty and self._last_metrics is not None:
+            return self._last_metrics
+        
+        # Clear before summing so a depth update that races the sums marks them dirty again
+        self._metrics_dirty = False
+        total_ce_volume, total_pe_volume, total_ce_oi, total_pe_oi = _depth_totals(self.ce_arr, self.pe_arr)
         
         pcr = total_pe_oi / total_ce_oi if total_ce_oi > 0 else 0
         
-        return {
+        self._last_metrics = {
             'total_ce_volume': total_ce_volume,
             'total_pe_volume': total_pe_volume,
             'total_volume': total_ce_volume + total_pe_volume,
@@ -387,20 +485,8 @@ class OptionChainManager:
             'total_pe_oi': total_pe_oi,
             'pcr': round(pcr, 2)
         }
+        return self._last_metrics
 
-    def get_strike_position(self, strike):
-        if not self.atm_strike:
-            return 0
-        return (strike - self.atm_strike) // self.strike_step
-
-    def get_position_tag(self, position):
-        if position == 0:
-            return 'ATM'
-        elif position > 0:
-            return f'OTM{abs(position)}'
-        else:
-            return f'ITM{abs(position)}'
-    
     def start_monitoring(self):
         self.monitoring_active = True
     
@@ -4,32 +4,103 @@ Handles real-time data streaming
 Adapted for standalone use (no DB dependencies)
 """
 
-import json
+import socket
 import threading
+from collections import deque
 import time
 import logging
+import orjson
 import websocket
 
 logger = logging.getLogger(__name__)
 
+# Subscription mode names to the numeric codes the server expects
+MODE_CODES = {'ltp': 1, 'quote': 2, 'depth': 3}
+MODE_NAMES = {code: mode for mode, code in MODE_CODES.items()}
+
+# Linux-only socket option; None elsewhere, where corking is skipped
+TCP_CORK = getattr(socket, 'TCP_CORK', None)
+
+# Keep-alive pings and automatic reconnect for run_forever (seconds)
+PING_INTERVAL = 20
+PING_TIMEOUT = 10
+RECONNECT_DELAY = 5
+
+# Keep-alive frames dropped before they reach the ring (frames arrive as
+# bytes); compared only when a frame is short enough to be one
+HEARTBEAT_FRAMES = frozenset([
+    b'{"type":"ping"}', b'{"type": "ping"}',
+    b'{"type":"heartbeat"}', b'{"type": "heartbeat"}'
+])
+HEARTBEAT_MAX_LEN = max(len(frame) for frame in HEARTBEAT_FRAMES)
+
+# Frames buffered between the socket reader and the dispatch thread (power of two)
+RING_SIZE = 4096
+
+
+def _level_from_dict(level):
+    """Depth level sent as {'price': ..., 'quantity': ...}"""
+    return level.get('price', 0), level.get('quantity', 0)
+
+
+def _level_from_sequence(level):
+    """Depth level sent as [price, quantity, ...]"""
+    if len(level) >= 2:
+        return level[0], level[1]
+    return 0, 0
+
+
 class ProfessionalWebSocketManager:
     """
     WebSocket Connection Management
     """
     
-    def __init__(self):
+    def __init__(self, max_subscribes_per_sec=50):
         self.ws = None
         self.ws_thread = None
+        self.dispatch_thread = None
+        self._closed = False
         self.active = False
         self.authenticated = False
-        self.subscriptions = set()
+        self._auth_event = threading.Event()
+        # (symbol, exchange, mode) -> (subscription, encoded subscribe frame),
+        # the frames are replayed as-is after reconnect
+        self.subscriptions = {}
+        
+        # Serializes writers of subscriptions and the handler tables; the
+        # dispatch thread only ever reads tuples that are swapped in whole,
+        # so it takes no lock (and stays correct without the GIL)
+        self._registry_lock = threading.Lock()
+        
+        # Send times of subscribe frames within the last second, for rate limiting
+        self.max_subscribes_per_sec = max_subscribes_per_sec
+        self._subscribe_times = deque()
+        self._rate_lock = threading.Lock()
+        
+        # (price, quantity) extractor for depth levels, chosen from the first depth frame
+        self.depth_level_extractor = None
         self.ws_url = None
         self.api_key = None
         
-        # Data handlers
-        self.quote_handlers = []
-        self.depth_handlers = []
-        self.ltp_handlers = []
+        # Single-producer/single-consumer ring: the reader thread only stores
+        # frames and advances _tail, the dispatch thread parses them and runs
+        # handlers, so a slow handler never stalls socket reads
+        self._ring = [None] * RING_SIZE
+        self._head = 0
+        self._tail = 0
+        self._not_empty = threading.Event()
+        
+        # Data handlers by mode, kept as tuples and replaced on register
+        self._handlers_by_type = {'ltp': (), 'quote': (), 'depth': ()}
+        
+        # Handlers that take market data frames undecoded; while only these
+        # are registered, frames are never parsed
+        self._raw_handlers = ()
+        self._has_decoded_handlers = False
+        
+        # Per-symbol handlers: one connection serves every chain, each tick
+        # goes only to the handlers registered for its symbol
+        self.symbol_handlers = {'quote': {}, 'depth': {}, 'ltp': {}}
     
     def connect(self, ws_url, api_key):
         """Establish WebSocket connection"""
@@ -37,6 +108,7 @@ class ProfessionalWebSocketManager:
             self.ws_url = ws_url
             self.api_key = api_key
             self.authenticated = False
+            self._auth_event.clear()
             
             # Create WebSocket connection
             self.ws = websocket.WebSocketApp(
@@ -47,25 +119,64 @@ class ProfessionalWebSocketManager:
                 on_close=self.on_close
             )
             
-            # Start WebSocket in separate thread
-            self.ws_thread = threading.Thread(target=self.ws.run_forever)
+            # Start WebSocket in separate thread; readiness is signalled by
+            # on_open/authentication, callers block in wait_until_ready().
+            # Text frames are passed on as undecoded bytes: orjson validates
+            # UTF-8 while parsing, so the client's own pass is redundant.
+            # Dropped connections are re-opened by run_forever itself and
+            # re-authenticate/resubscribe from on_open
+            self.ws_thread = threading.Thread(target=self.run)
             self.ws_thread.daemon = True
             self.ws_thread.start()
             
-            # Wait for connection to establish
-            time.sleep(2)
-            
-            self.active = True
-            logger.info("WebSocket connection established")
+            if self.dispatch_thread is None or not self.dispatch_thread.is_alive():
+                self.dispatch_thread = threading.Thread(target=self.dispatch_loop)
+                self.dispatch_thread.daemon = True
+                self.dispatch_thread.start()
             return True
             
         except Exception as e:
-            logger.error(f"Failed to connect WebSocket: {e}")
+            logger.error("Failed to connect WebSocket: %s", e)
             return False
     
+    def run(self):
+        """Keep the connection up until close() is called"""
+        while not self._closed:
+            self.ws.run_forever(
+                skip_utf8_validation=True,
+                ping_interval=PING_INTERVAL,
+                ping_timeout=PING_TIMEOUT,
+                reconnect=RECONNECT_DELAY
+            )
+            # run_forever only reconnects after errors; a close frame from
+            # the server (e.g. a restart) makes it return
+            if not self._closed:
+                logger.warning("WebSocket closed by server, reconnecting in %ss", RECONNECT_DELAY)
+                time.sleep(RECONNECT_DELAY)
+    
+    def close(self):
+        """Close the connection for good"""
+        self._closed = True
+        if self.ws:
+            self.ws.close()
+    
+    @property
+    def running(self):
+        """True while the connection thread is alive, connected or retrying"""
+        return self.ws_thread is not None and self.ws_thread.is_alive()
+    
+    def wait_until_ready(self, timeout=None):
+        """Block until the connection is authenticated; returns False on timeout"""
+        return self._auth_event.wait(timeout)
+    
     def on_open(self, ws):
         """WebSocket opened callback"""
         logger.info("WebSocket connection opened")
+        # A dropped reconnection is not reported through on_error/on_close,
+        # so stale ready state is cleared when the next connection opens
+        self._mark_disconnected()
+        self.active = True
+        self.depth_level_extractor = None
         self.authenticate()
     
     def authenticate(self):
@@ -75,68 +186,181 @@ class ProfessionalWebSocketManager:
                 "action": "authenticate",
                 "api_key": self.api_key
             }
-            logger.debug(f"Authenticating...")
-            self.ws.send(json.dumps(auth_msg))
+            logger.debug("Authenticating...")
+            self.ws.send(orjson.dumps(auth_msg))
     
     def on_message(self, ws, message):
+        """Queue an incoming frame for the dispatch thread"""
+        if len(message) <= HEARTBEAT_MAX_LEN and message in HEARTBEAT_FRAMES:
+            return
+        
+        tail = self._tail
+        if tail - self._head >= RING_SIZE:
+            logger.warning("Message ring full, waiting for handlers to catch up")
+            while tail - self._head >= RING_SIZE:
+                time.sleep(0.001)
+        
+        self._ring[tail & (RING_SIZE - 1)] = message
+        self._tail = tail + 1
+        if not self._not_empty.is_set():
+            self._not_empty.set()
+    
+    def dispatch_loop(self):
+        """Drain the ring, handling frames in arrival order"""
+        ring = self._ring
+        mask = RING_SIZE - 1
+        not_empty = self._not_empty
+        handle = self.handle_message
+        head = self._head
+        while True:
+            if head == self._tail:
+                # Re-check after clearing so a frame stored in between is not missed
+                not_empty.clear()
+                if head == self._tail and not not_empty.wait(1):
+                    if not self.ws_thread.is_alive() and head == self._tail:
+                        return
+                continue
+            
+            slot = head & mask
+            message = ring[slot]
+            ring[slot] = None
+            head += 1
+            self._head = head
+            handle(message)
+    
+    def handle_message(self, message):
         """Handle incoming WebSocket messages"""
         try:
-            data = json.loads(message)
+            raw_handlers = self._raw_handlers
+            if raw_handlers:
+                marker = b'"market_data"' if isinstance(message, bytes) else '"market_data"'
+                if marker in message:
+                    for handler in raw_handlers:
+                        try:
+                            handler(message)
+                        except Exception as e:
+                            logger.error("Error in raw handler: %s", e)
+                    if not self._has_decoded_handlers:
+                        return
+            
+            data = orjson.loads(message)
+            
+            msg_type = data.get("type")
+            
+            # Market data is nearly every frame, so it is tested first
+            if msg_type == "market_data":
+                self.process_market_data(data)
             
             # Handle authentication response
-            if data.get("type") == "auth":
+            elif msg_type == "auth":
                 if data.get("status") == "success":
                     self.authenticated = True
+                    self._auth_event.set()
                     logger.info("Authentication successful!")
                     if self.subscriptions:
-                        self.resubscribe_all()
+                        # Replaying is throttled; keep it off the dispatch
+                        # thread so ticks are not held up behind it
+                        threading.Thread(target=self.resubscribe_all, daemon=True).start()
                 else:
-                    logger.error(f"Authentication failed: {data}")
-                return
+                    logger.error("Authentication failed: %s", data)
             
-            # Handle market data
-            if data.get("type") == "market_data" or data.get("ltp") is not None:
+            # Untyped ticks
+            elif data.get("ltp") is not None:
                 self.process_market_data(data)
             
         except Exception as e:
-            logger.error(f"Error processing message: {e}")
+            logger.error("Error processing message: %s", e)
             
     def process_market_data(self, data):
         """Process market data and route to handlers"""
         # Extract actual data if nested
-        market_data = data.get('data', data)
+        market_data = data.get('data')
+        if market_data is None:
+            market_data = data
         
-        # Determine mode
-        mode = 'ltp'
+        # The server tags each frame with its subscription mode; sniff the
+        # payload only for frames that arrive without it
+        mode = MODE_NAMES.get(data.get('mode'))
+        if mode is None:
+            mode = self.detect_mode(market_data)
+        
+        handlers = self._handlers_by_type[mode]
+        routes = self.symbol_handlers[mode]
+        # Nobody listens to this mode (e.g. plain ltp frames)
+        if not handlers and not routes:
+            return
+        
+        # OpenAlgo puts the symbol beside the payload; handlers get it passed
+        # in so they never look it up again
+        symbol = (data.get('symbol') or market_data.get('symbol') or
+                  market_data.get('Symbol') or market_data.get('trading_symbol'))
+        routed = routes.get(symbol)
+        if routed:
+            handlers = handlers + routed if handlers else routed
+        elif not handlers:
+            return
+        
+        if mode == 'depth' and self.depth_level_extractor is None:
+            self.detect_depth_level_shape(market_data)
+        
+        # One chain per symbol is the usual case: call it without a loop
+        if len(handlers) == 1:
+            try:
+                handlers[0](symbol, market_data)
+            except Exception as e:
+                logger.error("Error in %s handler: %s", mode, e)
+            return
+        
+        for handler in handlers:
+            try:
+                handler(symbol, market_data)
+            except Exception as e:
+                logger.error("Error in %s handler: %s", mode, e)
+    
+    def detect_mode(self, market_data):
+        """Infer the mode of an untagged frame from its fields"""
         if 'depth' in market_data or 'bids' in market_data:
-            mode = 'depth'
-        elif 'open' in market_data:
-            mode = 'quote'
-            
-        # Route to handlers
-        if mode == 'depth':
-            for handler in self.depth_handlers:
-                try:
-                    handler(market_data)
-                except Exception as e:
-                    logger.error(f"Error in depth handler: {e}")
-        elif mode == 'quote':
-            for handler in self.quote_handlers:
-                try:
-                    handler(market_data)
-                except Exception as e:
-                    logger.error(f"Error in quote handler: {e}")
+            return 'depth'
+        if 'open' in market_data:
+            return 'quote'
+        return 'ltp'
+    
+    def detect_depth_level_shape(self, market_data):
+        """Pick the depth level extractor matching this connection's wire format"""
+        depth = market_data.get('depth')
+        if depth:
+            levels = depth.get('buy') or depth.get('sell') or depth.get('bids') or depth.get('asks')
+        else:
+            levels = market_data.get('bids') or market_data.get('asks')
+        
+        # Empty book: try again on the next depth frame
+        if levels:
+            if isinstance(levels[0], dict):
+                self.depth_level_extractor = _level_from_dict
+            else:
+                self.depth_level_extractor = _level_from_sequence
     
     def on_error(self, ws, error):
-        logger.error(f"WebSocket error: {error}")
+        logger.error("WebSocket error: %s", error)
+        # With reconnect on, the first connection's drop is reported here
+        # instead of on_close; drops of later connections are not reported
+        # at all and surface as send failures in _send_subscribe
+        if isinstance(error, (websocket.WebSocketException, OSError)):
+            self._mark_disconnected()
     
     def on_close(self, ws, close_status_code, close_msg):
         logger.warning("WebSocket connection closed")
+        self._mark_disconnected()
+    
+    def _mark_disconnected(self):
+        """Hold new subscriptions back until the next successful authentication"""
         self.active = False
+        self.authenticated = False
+        self._auth_event.clear()
         
     def subscribe(self, subscription):
         """Subscribe to symbol"""
-        if not self.ws or not self.authenticated:
+        if not self.ws:
             logger.warning("WebSocket not ready for subscription")
             return False
             
@@ -144,42 +368,120 @@ class ProfessionalWebSocketManager:
         exchange = subscription.get('exchange')
         mode = subscription.get('mode', 'ltp')
         
-        # Map mode to number
-        mode_map = {'ltp': 1, 'quote': 2, 'depth': 3}
-        mode_num = mode_map.get(mode, 1)
-        
-        message = {
+        frame = self._subscribe_frame(symbol, exchange, mode)
+        with self._registry_lock:
+            self.subscriptions[(symbol, exchange, mode)] = (subscription, frame)
+        return self._send_subscribe((frame,))
+    
+    @staticmethod
+    def _subscribe_frame(symbol, exchange, mode):
+        """Encoded subscribe message; orjson emits UTF-8 bytes, sent as-is in a text frame"""
+        return orjson.dumps({
             'action': 'subscribe',
             'symbol': symbol,
             'exchange': exchange,
-            'mode': mode_num,
+            'mode': MODE_CODES.get(mode, 1),
             'depth': 5
-        }
-        
-        self.ws.send(json.dumps(message))
-        self.subscriptions.add(json.dumps(subscription))
-        time.sleep(0.05)
-        return True
+        })
+    
+    def _set_cork(self, enabled):
+        """Toggle TCP_CORK so a burst of small frames goes out in full segments"""
+        sock = getattr(getattr(self.ws, 'sock', None), 'sock', None)
+        if TCP_CORK is None or sock is None:
+            return
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, TCP_CORK, int(enabled))
+        except OSError:
+            pass
+    
+    def _throttle(self):
+        """Block only when max_subscribes_per_sec frames were already sent in the last second"""
+        with self._rate_lock:
+            sent = self._subscribe_times
+            now = time.monotonic()
+            while sent and now - sent[0] >= 1:
+                sent.popleft()
+            
+            if len(sent) >= self.max_subscribes_per_sec:
+                time.sleep(1 - (now - sent[0]))
+                sent.popleft()
+                now = time.monotonic()
+            sent.append(now)
         
     def subscribe_batch(self, instruments, mode='ltp'):
-        """Batch subscribe"""
-        for inst in instruments:
-            self.subscribe({
-                'symbol': inst.get('symbol'),
-                'exchange': inst.get('exchange'),
-                'mode': mode
-            })
+        """Batch subscribe, one frame per symbol as OpenAlgo expects"""
+        if not self.ws:
+            logger.warning("WebSocket not ready for subscription")
+            return False
+        
+        frames = []
+        subscribe_frame = self._subscribe_frame
+        with self._registry_lock:
+            subscriptions = self.subscriptions
+            for inst in instruments:
+                symbol, exchange = inst.get('symbol'), inst.get('exchange')
+                frame = subscribe_frame(symbol, exchange, mode)
+                subscriptions[(symbol, exchange, mode)] = (
+                    {'symbol': symbol, 'exchange': exchange, 'mode': mode}, frame)
+                frames.append(frame)
+        
+        if not frames:
+            return True
+        return self._send_subscribe(frames)
+    
+    def _send_subscribe(self, frames):
+        """Send recorded subscribe frames, or leave them for resubscribe_all while disconnected"""
+        if not self.authenticated:
+            logger.warning("WebSocket not connected, subscription will be sent after authentication")
+            return False
+        
+        throttle = self._throttle
+        send = self.ws.send
+        self._set_cork(True)
+        try:
+            for frame in frames:
+                throttle()
+                send(frame)
+        except (websocket.WebSocketConnectionClosedException, OSError) as e:
+            # Frames are already recorded; resubscribe_all replays them
+            logger.warning("WebSocket connection lost while subscribing: %s", e)
+            self._mark_disconnected()
+            return False
+        finally:
+            # Uncorking flushes whatever is still queued
+            self._set_cork(False)
+        return True
             
     def resubscribe_all(self):
-        """Resubscribe all symbols"""
-        for sub_str in self.subscriptions:
-            self.subscribe(json.loads(sub_str))
+        """Resend every stored subscribe frame without re-encoding"""
+        with self._registry_lock:
+            frames = [frame for _, frame in self.subscriptions.values()]
+        self._send_subscribe(frames)
             
     def register_handler(self, mode, handler):
-        """Register data handler"""
-        if mode == 'quote':
-            self.quote_handlers.append(handler)
-        elif mode == 'depth':
-            self.depth_handlers.append(handler)
-        elif mode == 'ltp':
-            self.ltp_handlers.append(handler)
+        """Register data handler, called as handler(symbol, data)"""
+        with self._registry_lock:
+            handlers = self._handlers_by_type.get(mode)
+            if handlers is not None:
+                self._handlers_by_type[mode] = handlers + (handler,)
+                self._has_decoded_handlers = True
+    
+    def register_raw_handler(self, handler):
+        """
+        Register a handler for undecoded frames
+        
+        Raw handlers receive every market data frame exactly as read from
+        the socket, before decoding, whatever the mode.
+        """
+        with self._registry_lock:
+            self._raw_handlers += (handler,)
+    
+    def register_symbol_handler(self, mode, symbol, handler):
+        """Register data handler for a single symbol, called as handler(symbol, data)"""
+        with self._registry_lock:
+            routes = self.symbol_handlers[mode]
+            handlers = routes.get(symbol, ())
+            if handler not in handlers:
+                # Swap in a new tuple so the reader thread never sees a half-updated list
+                routes[symbol] = handlers + (handler,)
+                self._has_decoded_handlers = True